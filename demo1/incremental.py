@@ -2,7 +2,7 @@ import random
 import numpy as np
 from collections import defaultdict, Counter
 from .validate import validate_set, validate_dict, validate_no_dupes
-from .util import memoize
+from .util import memoize_picklable
 
 class IncrementalMoveCache():
 	'''
@@ -62,8 +62,12 @@ class IncrementalMoveCache():
 		out = Counter()
 		sources = defaultdict(Counter)
 		for (kindset, count) in self.undecided_counts().items():
-			# Total occurrences of each number 1-n after 'count' throws of an n-sided die
-			counts = np.random.multinomial(count, [1./len(kindset)]*len(kindset))
+			if len(kindset) == 1:
+				# Nothing to decide; skip the (comparatively expensive) draw.
+				counts = [count]
+			else:
+				# Total occurrences of each number 1-n after 'count' throws of an n-sided die
+				counts = np.random.multinomial(count, [1./len(kindset)]*len(kindset))
 
 			for (k,c) in zip(kindset, counts):
 				out[k] += c
@@ -348,7 +352,7 @@ class ZobristKey:
 	susceptible to collision).
 	'''
 	def __init__(self, values=(), bits=32, rng=random):
-		if rng: self.__genval = memoize(arg_eating_partial(rng.getrandbits, bits))
+		if rng: self.__genval = memoize_picklable(arg_eating_partial(rng.getrandbits, bits))
 		else:   self.__genval = hash
 		self.__current = 0
 		self.update(values)
@@ -359,8 +363,10 @@ class ZobristKey:
 
 	def update(self, values):
 		''' Toggle the presence of many items in the hash. '''
-		for x in values:
-			self.toggle(x)
+		# (xor them all together first, rather than toggling one at a time)
+		from functools import reduce
+		from operator import xor
+		self.__current = reduce(xor, map(self.__genval, values), self.__current)
 
 	def value(self):
 		''' Get the current value of the hash. '''
@@ -379,6 +385,15 @@ class ZobristKey:
 		out.__genval = self.__genval
 		return out
 
+	def clone(self):
+		'''
+		Create a copy of this key, compatible with it (as in ``derive``)
+		and starting from the same value.
+		'''
+		out = self.derive()
+		out.__current = self.__current
+		return out
+
 def arg_eating_partial(func, *args, **kw):
 	'''
 	``arg_eating_partial(func, x, y)`` is like ``lambda *_, **_: func(x,y)``
@@ -634,6 +649,18 @@ class IncrementalMoveCacheTests(unittest.TestCase):
 		mc.clear_all('c')
 		self.validate(mc)
 
+	def test_randomly_decided_counts(self):
+		mc = self.make_mc(AB='abcd', A='e', C='fg')
+		(counts, sources) = mc.randomly_decided_counts()
+
+		# unambiguous moves always land in their kind
+		self.assertEqual(counts['C'], 2)
+		self.assertEqual(sources['C'], {frozenset('C'): 2})
+		# ambiguous ones are split, but none are lost
+		self.assertEqual(counts['A'] + counts['B'], 5)
+		self.assertEqual(sources['A'][frozenset('A')], 1)
+		self.assertEqual(sum(sources['A'].values()), counts['A'])
+
 def flat(it):
 	for x in it:
 		yield from x
@@ -110,18 +110,30 @@ class RuleMoveDivacancy(MultiKindRule):
 
 	def all_moves(self, state):
 		for x in state.divacancies():
-			yield from self.moves_from_node(state, x.node)
+			yield from self.moves_from_divacancy(state, x.node)
 
 	def moves_dependent_on(self, state, nodes):
-		for node in state.grid.nodes_in_distance_range(nodes, 0, 1):
-			yield from self.moves_from_node(state, node)
-
-	def moves_from_node(self, state, node):
-		if state.is_divacancy(node):
-			for (nbr,near,far) in state.grid.neighbors_and_mutuals(node):
-				if state.is_pristine(nbr):
-					kind = self.move_kind(state, near, far)
-					yield ((node, nbr), kind)
+		region = self.__region_around(state.grid, nodes)
+		for node in filter(state.is_divacancy, region):
+			yield from self.moves_from_divacancy(state, node)
+
+	# (nodes, region) from the most recent call
+	__last_region = (None, ())
+	def __region_around(self, grid, nodes):
+		# pre_ and post_status_change receive the same nodes object for a move,
+		# and the region only depends on the grid; compute it once for both.
+		if self.__last_region[0] is not nodes:
+			region = tuple(grid.nodes_in_distance_range(nodes, 0, 1))
+			self.__last_region = (nodes, region)
+		return self.__last_region[1]
+
+	def moves_from_divacancy(self, state, node):
+		''' Moves for a node already known to be a divacancy. '''
+		is_pristine = state.is_pristine
+		for (nbr,near,far) in state.grid.neighbors_and_mutuals(node):
+			if is_pristine(nbr):
+				kind = self.move_kind(state, near, far)
+				yield ((node, nbr), kind)
 
 	# Organized according to a code:
 	KINDS = [
@@ -131,9 +143,8 @@ class RuleMoveDivacancy(MultiKindRule):
 		'missing-both',  # combination thereof
 	]
 	def move_kind(self, state, near, far):
-		return self.KINDS[
-			int(state.is_divacancy(near)) + 2*int(state.is_divacancy(far))
-		]
+		# (bools are ints, so the code is computed without branching)
+		return self.KINDS[state.is_divacancy(near) + 2*state.is_divacancy(far)]
 
 
 #-------------------------------------------------------------------------
@@ -193,8 +204,8 @@ class RuleDestroyTrefoil(OneKindRule):
 		# find trefoils for which at least one vertex was invalidated
 		remaining = set(filter(state.is_trefoil, nodes))
 		while remaining:
-			trefoil_nodes = frozenset(state.trefoil_nodes_at(remaining.pop()))
-			remaining -= trefoil_nodes # skip dupes
+			trefoil_nodes = state.trefoil_nodes_at(remaining.pop())
+			remaining.difference_update(trefoil_nodes) # skip dupes
 			yield trefoil_nodes
 
 #-------------------------------------------------------------------------
@@ -67,6 +67,18 @@ class KmcSim:
 
 			self.rules_and_rates[rule] = rates
 
+		# The status change callbacks are invoked for every rule on every move;
+		# look them up once here rather than on each dispatch.
+		self.__pre_status_handlers = [r.pre_status_change for r in self.rules_and_rates]
+		self.__post_status_handlers = [r.post_status_change for r in self.rules_and_rates]
+
+		# flattened for single lookups in the per-step weight computation
+		self.__rates = {
+			(rule,kind):rate
+			for (rule, rates) in self.rules_and_rates.items()
+			for (kind,rate) in rates.items()
+		}
+
 	@staticmethod
 	def __validate_kinds(rule, rates):
 		from warnings import warn
@@ -78,7 +90,7 @@ class KmcSim:
 				warn('config: %s: Unexpected kind: %s' % (rule.format(kind)))
 
 	def rate(self, rule, kind):
-		return self.rules_and_rates[rule][kind]
+		return self.__rates[(rule,kind)]
 
 	def rates_info(self):
 		d = {}
@@ -98,7 +110,10 @@ class KmcSim:
 			(rule_counts, rule_sources) = rule.move_cache.randomly_decided_counts()
 
 			# Tag kinds with the rules that own them in the output counter.
-			counts += { (rule,kind):count for (kind,count) in rule_counts.items() }
+			# (keys are unique to each rule, so there is nothing to add up)
+			for (kind,count) in rule_counts.items():
+				if count:
+					counts[(rule,kind)] = count
 			sources[rule] = rule_sources
 
 		return (counts, sources)
@@ -117,8 +132,8 @@ class KmcSim:
 		(counts, sources) = self.__rule_kind_counts()
 
 		# Choose which rule and kind of move should occur
-		k_w_pairs = [((rule,kind), count * self.rate(rule, kind))
-		             for ((rule,kind), count) in counts.items()]
+		rates = self.__rates
+		k_w_pairs = [(key, count * rates[key]) for (key, count) in counts.items()]
 		(rule, kind) = weighted_choice(k_w_pairs)
 
 		# Choose a single move of this kind
@@ -148,13 +163,13 @@ class KmcSim:
 		'''
 		affected_nodes = tuple(rule.nodes_affected_by(move))
 
-		for r in self.rules_and_rates:
-			r.pre_status_change(self.state, affected_nodes)
+		for handler in self.__pre_status_handlers:
+			handler(self.state, affected_nodes)
 
 		rule.perform(move, self.state)
 
-		for r in self.rules_and_rates:
-			r.post_status_change(self.state, affected_nodes)
+		for handler in self.__post_status_handlers:
+			handler(self.state, affected_nodes)
 
 	def validate(self):
 		'''
@@ -201,15 +216,22 @@ class RuleSpec:
 # The original intent was for them to be stateless bundles of
 # callbacks, but they now have a stateful aspect (the move_cache).
 class Rule:
+	# Names of the keyword arguments accepted by ``subinit``.
+	# (computed once per class in __init_subclass__)
+	_subinit_kw = frozenset()
+
+	def __init_subclass__(cls, **kw):
+		from inspect import signature
+		super().__init_subclass__(**kw)
+		cls._subinit_kw = frozenset(signature(cls.subinit).parameters) - set(['self'])
+
 	def __init__(self, initial_state, init_kw):
 		self.move_cache = IncrementalMoveCache()
 		self.initialize_moves(initial_state)
 
 		# Give additional keywords to subinit.
 		# These may come from config, so validate them.
-		from inspect import getargspec
-		(args,_,_,_) = getargspec(self.subinit)
-		bad_kw_args = set(init_kw) - (set(args) - set(['self']))
+		bad_kw_args = set(init_kw) - self._subinit_kw
 		if bad_kw_args:
 			raise RuntimeError('unknown property of %s: %r' %
 				(self.format(), bad_kw_args.pop()))
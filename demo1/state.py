@@ -1,16 +1,20 @@
 
 from __future__ import division
 
+import os
 import itertools
 import random
+import numpy as np
 import hexagonal as hex
 
 from .incremental import ZobristKey
-from .validate import validate_dict, validate_equal
-from .util import zip_exact, window2
+from .validate import validate_dict, validate_equal, validate_no_dupes
+from .util import zip_exact, window2, memoize
 
-try: import cPickle as pickle
-except ImportError: import pickle
+# Sanity checks on the hot paths of State (mutators, status predicates) are
+# only performed when the KMC_DEBUG environment variable is set, as they add
+# up over long runs.  ``State.validate`` performs its checks regardless.
+DEBUG = bool(os.environ.get('KMC_DEBUG'))
 
 # Every Rule has at least one kind; for those with one it is usually this:
 # (appears as config key, and as a possible value in MoveCache)
@@ -22,31 +26,52 @@ DEFAULT_KIND = 'natural'
 LAYERS = [1,2]   # possible values of "layers" for monovacancy
 BOTH_LAYERS = 3  # value of "layers" for divacancy
 
-# These namedtuples are used together with their type as a tagged union;
-# e.g.  (type(obj), obj), where the type serves as the discriminator.
+# These namedtuples are the entities that make up a State.
+# Their types also serve as the tags returned by ``State.node_status``.
 #
-# (the explicit discriminator is because namedtuples are (unfortunately)
-#  designed to be compatible with tuples, which means their __eq__ and
-#  __hash__ methods do not care about the type)
+# (entities of different types are never mixed in one container, because
+#  namedtuples are (unfortunately) designed to be compatible with tuples,
+#  which means their __eq__ and __hash__ methods do not care about the type)
 from collections import namedtuple
 Pristine = namedtuple('Pristine', [])
 Vacancy = namedtuple('Vacancy', ['node', 'layers'])
-Trefoil = namedtuple('Trefoil', ['nodes'])
-
-# only need one instance
-PRISTINE = Pristine()
-PRISTINE_ENTRY = (Pristine, PRISTINE)
+Trefoil = namedtuple('Trefoil', ['nodes']) # nodes in canonical_trefoil_nodes form
+
+def canonical_trefoil_nodes(nodes):
+	''' The form in which a trefoil's nodes are stored: a sorted tuple of nodes. '''
+	# (cheaper to build, hash and compare than a frozenset)
+	return tuple(sorted(map(tuple, nodes)))
+
+# Codes stored in the per-node status array of State.
+# A vacancy is stored as its vacant layers (one of LAYERS, or BOTH_LAYERS),
+#  so that the status of any non-trefoil node doubles as its layerset.
+STATUS_PRISTINE = 0
+STATUS_TREFOIL = 4
+
+# The tag for each status code, and the (inclusive) range of status codes
+# for each tag.  (a range can be tested with two comparisons; np.isin with
+# a list of codes is an order of magnitude slower)
+STATUS_TAGS = (Pristine, Vacancy, Vacancy, Vacancy, Trefoil)
+TAG_STATUSES = {
+	Pristine: (STATUS_PRISTINE, STATUS_PRISTINE),
+	Vacancy:  (min(LAYERS), BOTH_LAYERS),
+	Trefoil:  (STATUS_TREFOIL, STATUS_TREFOIL),
+}
+assert [t for (t, (lo, hi)) in sorted(TAG_STATUSES.items(), key=lambda kv: kv[1])
+	for _ in range(lo, hi + 1)] == list(STATUS_TAGS)
 
 # ``State(zobrist=HASH)`` uses ``hash`` for zobrist diffs.
 HASH = object()
 
 class State:
+	# States are cloned frequently; skip the per-instance __dict__.
+	__slots__ = ('grid', '__vacancies', '__trefoils', '__status', '__trefoil_at', '__zobrist')
 
 	def __init__(self, dim, zobrist=None):
 		self.grid = Grid(dim)
 		self.__vacancies = set()
 		self.__trefoils = set()
-		self.__nodes = self.__compute_nodes_lookup()
+		(self.__status, self.__trefoil_at) = self.__compute_nodes_lookup()
 
 		self.__zobrist = None
 		if isinstance(zobrist, int): self.__zobrist = ZobristKey(bits=zobrist)
@@ -56,8 +81,7 @@ class State:
 	@classmethod
 	def from_entity_lists(cls, dim, vacancies, trefoils, zobrist=None):
 		self = cls(dim, zobrist=zobrist)
-		for (node, layer) in vacancies:
-			self.new_vacancy(node, layer)
+		self.new_vacancies(vacancies)
 		for (nodes,) in trefoils:
 			self.new_trefoil(nodes)
 		return self
@@ -66,8 +90,40 @@ class State:
 		return self.grid.dim
 
 	def clone(self):
-		''' Creates a copy of the state (minus event bindings). '''
-		return pickle.loads(pickle.dumps(self))
+		''' Creates a copy of the state.
+
+		This is the fast way to copy a State; pickle round-trips also work,
+		but rebuild the node lookup from scratch. '''
+		# Entities are immutable, so shallow copies of the containers suffice.
+		# The Grid is never modified after construction and can be shared.
+		out = type(self).__new__(type(self))
+		out.grid = self.grid
+		out.__vacancies = set(self.__vacancies)
+		out.__trefoils = set(self.__trefoils)
+		out.__status = self.__status.copy()
+		out.__trefoil_at = dict(self.__trefoil_at)
+		out.__zobrist = self.__zobrist and self.__zobrist.clone()
+		return out
+
+	# (so that the copy module also takes the fast path; and a shallow copy
+	#  going through __getstate__ would share the entity sets between two
+	#  node lookups)
+	def __copy__(self):
+		return self.clone()
+
+	def __deepcopy__(self, memo):
+		return self.clone()
+
+	# For pickling (e.g. checkpoints or multiprocessing); not used internally.
+	# The node lookup is derived from the entity lists, so rather than sending
+	# one entry per grid node, it is left out and rebuilt on load.
+	def __getstate__(self):
+		return (self.grid.dim, self.__vacancies, self.__trefoils, self.__zobrist)
+
+	def __setstate__(self, state):
+		(dim, self.__vacancies, self.__trefoils, self.__zobrist) = state
+		self.grid = Grid(dim)
+		(self.__status, self.__trefoil_at) = self.__compute_nodes_lookup()
 
 	#------------------------------------------
 	# Serialization
@@ -92,12 +148,14 @@ class State:
 		}
 
 	#------------------------------------------
-	# THE __nodes CACHE:
-	# A lookup of data for individual nodes.
+	# THE NODE LOOKUP:
+	# Data for individual nodes, derived from the entity lists.
 
-	# The values of __nodes are like a tagged union.
-	# They are of the form (status, data), where status serves as a descriminator
-	#  for how to interpret the data.
+	# * __status is a uint8 array of shape dim holding a status code (see
+	#   STATUS_TAGS) for every node.  Being dense, it is cheap to index, copy,
+	#   and scan in bulk.
+	# * __trefoil_at maps each node of each trefoil to its Trefoil.
+	#   (vacancies need no such table; they are fully described by __status)
 
 	def validate(self):
 		'''
@@ -110,34 +168,45 @@ class State:
 		self.__validate_zobrist_key()
 		return True
 
-	# This function is the "gold standard" for what __nodes should look like.
+	# This function is the "gold standard" for what the node lookup should look like.
 	# Rules must strive to preserve this definition.
 	def __compute_nodes_lookup(self):
-		''' generates __nodes from __vacancies and __trefoils '''
-		cache = { x:PRISTINE_ENTRY for x in self.grid.nodes() }
+		''' generates (__status, __trefoil_at) from __vacancies and __trefoils '''
+		status = np.full(self.grid.dim, STATUS_PRISTINE, dtype=np.uint8)
+		trefoil_at = {}
 
 		for vacancy in self.__vacancies:
-			cache[vacancy.node] = (Vacancy, vacancy)
+			status[vacancy.node] = vacancy.layers
 
 		for trefoil in self.__trefoils:
 			for node in trefoil.nodes:
-				cache[node] = (Trefoil, trefoil)
+				status[node] = STATUS_TREFOIL
+				trefoil_at[node] = trefoil
 
-		return cache
+		return (status, trefoil_at)
 
 	def __validate_nodes_lookup(self):
-		validate_dict(
-			self.__nodes,
-			self.__compute_nodes_lookup(),
-			name1='cached', name2='expected', key='node')
+		(status, trefoil_at) = self.__compute_nodes_lookup()
+
+		# Compare in bulk first; validate_dict is only needed to describe a mismatch.
+		# (only non-pristine nodes are compared there, to keep the dicts small)
+		if not np.array_equal(self.__status, status):
+			validate_dict(
+				sparse_status_dict(self.__status),
+				sparse_status_dict(status),
+				name1='cached', name2='expected', key='node', value='status')
+		if self.__trefoil_at != trefoil_at:
+			validate_dict(
+				self.__trefoil_at, trefoil_at,
+				name1='cached', name2='expected', key='node', value='trefoil')
 
 		return True
 
 	def __validate_zobrist_key(self):
 		if self.is_zobrist_enabled():
 			expected = self.__zobrist.derive()
-			expected.update((Vacancy,x) for x in self.__vacancies)
-			expected.update((Trefoil,x) for x in self.__trefoils)
+			expected.update(self.__vacancies)
+			expected.update(self.__trefoils)
 			validate_equal(self.__zobrist.value(), expected.value())
 		return True
 
@@ -146,35 +215,57 @@ class State:
 			if not (1 <= x.layers <= 3):
 				raise AssertionError('vacancy with bad layer: %s' % x.layers)
 
+		# (mutators only check that nodes are free in DEBUG mode)
+		occupied = [x.node for x in self.__vacancies]
+		occupied += [node for x in self.__trefoils for node in x.nodes]
+		validate_no_dupes(occupied, name='entities', item='node')
+
 		return True
 
 	#------------------------------------------
 	# Accessors/iterators
 
-	def pristine_nodes(self): return filter(self.is_pristine, self.grid.nodes())
+	def pristine_nodes(self): return self.nodes_by_status(Pristine)
 
 	def vacancies(self): return self.__vacancies.__iter__()
 	def divacancies(self): return (x for x in self.__vacancies if x.layers == BOTH_LAYERS)
 	def monovacancies(self): return (x for x in self.__vacancies if x.layers != BOTH_LAYERS)
 
 	def nodes(self): return self.grid.nodes()
-	def node_status(self, node): return self.__nodes[node][0]
-	def nodes_with_status(self): return [(n, self.node_status(n)) for n in self.nodes()]
+	def node_status(self, node): return STATUS_TAGS[self.__status.item(node)]
+	def nodes_with_status(self):
+		tags = map(STATUS_TAGS.__getitem__, self.__status.ravel().tolist())
+		return zip(self.nodes(), tags)
+	def nodes_by_status(self, status):
+		''' Iterate over the nodes whose status is ``status``. (e.g. ``Pristine``) '''
+		mask = self.__status_mask(status)
+		# (flat indices into the status array are node ids, so the nodes can be
+		#  taken from the grid rather than built as new tuples)
+		return map(self.grid.all_nodes().__getitem__, np.flatnonzero(mask).tolist())
+	def count_nodes_by_status(self, status):
+		''' Count the nodes whose status is ``status``. '''
+		return np.count_nonzero(self.__status_mask(status))
+
+	def __status_mask(self, status):
+		(lo, hi) = TAG_STATUSES[status]
+		if lo == hi: return self.__status == lo
+		else:        return (self.__status >= lo) & (self.__status <= hi)
 
 	def trefoils(self): return self.__trefoils.__iter__()
 	def trefoil_nodes_at(self, node):
-		(status,trefoil) = self.__nodes[node]
-		if status is not Trefoil:
+		''' The nodes of the trefoil at a node, in canonical_trefoil_nodes form. '''
+		trefoil = self.__trefoil_at.get(node)
+		if trefoil is None:
 			raise KeyError('node not a trefoil')
-		return frozenset(trefoil.nodes)
+		return trefoil.nodes
 
 	def vacant_layerset_at(self, node):
 		''' Get the layers value (an int to manipulate as a bitset) of a node.
 		0 = no vacancies, 1 or 2 = monovacancy, 3 = divacancy '''
-		(status,vacancy) = self.__nodes[node]
-		if status is Pristine: return 0
-		elif status is Vacancy: return vacancy.layers
-		else: raise KeyError('monovacancy layers not defined at node')
+		status = self.__status.item(node)
+		if status == STATUS_TREFOIL:
+			raise KeyError('monovacancy layers not defined at node')
+		return status
 
 	#------------------------------------------
 	# Public mutators
@@ -184,8 +275,11 @@ class State:
 
 	# General flow is:
 	# * Update the entity lists (__vacancies, __trefoils)
-	# * Update the __nodes table.
-	# * Update the __zobrist key.
+	# * Update the node lookup (__status, __trefoil_at).
+	# * Update the __zobrist key, if there is one.
+	#   (tested inline, so that the usual case of no key costs a single check)
+	#   The entities are toggled as-is, without their type; a Vacancy and a
+	#   Trefoil can never compare equal, as they have different lengths.
 
 	# NOTES on implementation constraints:
 	# * These methods should be regarded as the primitive operations for
@@ -199,104 +293,104 @@ class State:
 	def new_vacancy(self, node, layers):
 		''' Turn a pristine node into a mono- or divacancy. '''
 		node = tuple(node)
-		assert self.is_pristine(node)
+		if DEBUG: assert self.is_pristine(node)
 
 		vacancy = Vacancy(node, layers)
 		self.__vacancies.add(vacancy)
-		self.__nodes[node] = (Vacancy, vacancy)
-		self.__zobrist_toggle((Vacancy, vacancy))
+		self.__status[node] = layers
+		if self.__zobrist: self.__zobrist.toggle(vacancy)
+
+	def new_vacancies(self, vacancies):
+		''' Bulk version of ``new_vacancy``, taking ``(node, layers)`` pairs. '''
+		# (for populating a State, where per-node calls would add up)
+		vacancies = [Vacancy(tuple(node), layers) for (node, layers) in vacancies]
+		if not vacancies:
+			return
+		if DEBUG:
+			validate_no_dupes([x.node for x in vacancies], name='vacancies', item='node')
+			assert all(self.is_pristine(x.node) for x in vacancies)
+
+		self.__vacancies.update(vacancies)
+		(nodes, layers) = zip(*vacancies)
+		self.__status[tuple(zip(*nodes))] = layers
+		if self.__zobrist: self.__zobrist.update(vacancies)
 
 	def new_trefoil(self, nodes):
 		''' Turn three pristine nodes into a trefoil. '''
-		nodes = frozenset(map(tuple, nodes))
-		assert len(nodes) == 3
-		assert all(map(self.is_pristine, nodes))
+		nodes = canonical_trefoil_nodes(nodes)
+		if DEBUG:
+			assert len(nodes) == 3 and nodes[0] != nodes[1] != nodes[2]
+			assert all(map(self.is_pristine, nodes))
 
 		trefoil = Trefoil(nodes)
 		self.__trefoils.add(trefoil)
 		for node in nodes:
-			self.__nodes[node] = (Trefoil, trefoil)
-		self.__zobrist_toggle((Trefoil, trefoil))
+			self.__status[node] = STATUS_TREFOIL
+			self.__trefoil_at[node] = trefoil
+		if self.__zobrist: self.__zobrist.toggle(trefoil)
 
 	def pop_divacancy(self, node):
 		''' Turn a divacancy into a pristine node. '''
-		assert self.is_divacancy(node)
+		if DEBUG: assert self.is_divacancy(node)
 		self.pop_vacancy(node)
 
 	def pop_vacancy(self, node):
 		''' Turn a mono- or divacancy into a pristine node. '''
 		vacancy = self.__find_vacancy(node)
 		self.__vacancies.remove(vacancy)
-		self.__nodes[node] = PRISTINE_ENTRY
-		self.__zobrist_toggle((Vacancy, vacancy))
+		self.__status[node] = STATUS_PRISTINE
+		if self.__zobrist: self.__zobrist.toggle(vacancy)
 		return vacancy
 
 	def pop_trefoil(self, nodes):
 		''' Turn a trefoil into three pristine nodes. '''
-		nodes = frozenset(map(tuple, nodes))
-		assert len(nodes) == 3
+		nodes = canonical_trefoil_nodes(nodes)
+		if DEBUG: assert len(nodes) == 3
 
 		trefoil = self.__find_trefoil(nodes)
 		self.__trefoils.remove(trefoil)
 		for node in nodes:
-			self.__nodes[node] = PRISTINE_ENTRY
-		self.__zobrist_toggle((Trefoil, trefoil))
+			self.__status[node] = STATUS_PRISTINE
+			del self.__trefoil_at[node]
+		if self.__zobrist: self.__zobrist.toggle(trefoil)
 		return trefoil
 
-	def __zobrist_toggle(self, value):
-		if self.__zobrist:
-			self.__zobrist.toggle(value)
-
 	def __find_vacancy(self, node):
-		(status,vacancy) = self.__nodes[node]
-		assert status is Vacancy
-		assert vacancy.node == node
-		return vacancy
+		layers = self.__status.item(node)
+		if DEBUG: assert STATUS_PRISTINE < layers <= BOTH_LAYERS
+		return Vacancy(node, layers)
 
 	def __find_trefoil(self, nodes):
-		nodes = frozenset(nodes)
-		(status,trefoil) = self.__nodes[next(iter(nodes))]
-		assert status is Trefoil
-		assert trefoil.nodes == nodes
+		trefoil = self.__trefoil_at[nodes[0]]
+		if DEBUG: assert trefoil.nodes == nodes
 		return trefoil
 
 	#------------------------------------------
+	# (``ndarray.item`` gives a python int, which compares faster than a numpy scalar)
 	def is_monovacancy(self, node):
 		''' Test that a node is a monovacancy. '''
-		tag, data = self.__nodes[node]
-		assert tag in [Pristine, Vacancy, Trefoil], 'function not updated'
-		return tag is Vacancy and data.layers in LAYERS
+		return self.__status.item(node) in LAYERS
 
 	def is_divacancy(self, node):
 		''' Test that a node is a divacancy. '''
-		tag, data = self.__nodes[node]
-		assert tag in [Pristine, Vacancy, Trefoil], 'function not updated'
-		return tag is Vacancy and data.layers == BOTH_LAYERS
+		return self.__status.item(node) == BOTH_LAYERS
 
 	def is_vacancy(self, node):
 		''' Test that a node is a mono or divacancy. '''
-		tag, data = self.__nodes[node]
-		assert tag in [Pristine, Vacancy, Trefoil], 'function not updated'
-		return tag is Vacancy
+		return STATUS_PRISTINE < self.__status.item(node) <= BOTH_LAYERS
 
 	def is_trefoil(self, node):
 		''' Test that a node is in a trefoil. '''
-		tag, data = self.__nodes[node]
-		assert tag in [Pristine, Vacancy, Trefoil], 'function not updated'
-		return tag is Trefoil
+		return self.__status.item(node) == STATUS_TREFOIL
 
 	def is_pristine(self, node):
 		''' Test that a node is pristine. (i.e. all atoms are present)'''
-		tag, data = self.__nodes[node]
-		assert tag in [Pristine, Vacancy, Trefoil], 'function not updated'
-		return tag is Pristine
+		return self.__status.item(node) == STATUS_PRISTINE
 
 	def has_defined_layerset(self, node):
 		''' Test that a node has a well-defined set of monovacancies.
 		True for pristine nodes, monovacancies and divacancies. '''
-		tag, data = self.__nodes[node]
-		assert tag in [Pristine, Vacancy, Trefoil], 'function not updated'
-		return tag is not Trefoil
+		return self.__status.item(node) != STATUS_TREFOIL
 
 	#------------------------------------------
 	# FIXME Feels like a bit of a hack that code using State might need
@@ -316,15 +410,20 @@ class State:
 		assert self.is_zobrist_enabled(), "shouldn't be called unless --zobrist is set..."
 		return self.__zobrist.value()
 
+def sparse_status_dict(status):
+	''' ``{node: code}`` for the non-pristine nodes of a status array. '''
+	return {tuple(node): status.item(tuple(node)) for node in np.argwhere(status).tolist()}
+
 #------------------------------------------------------------------
 
 RANDOM_MODES =  ['exact','approx']
-RANDOM_ASSIGN_FUNC = {
-	'divacancy':   lambda s,n,rng: s.new_divacancy(n),
-	'monovacancy': lambda s,n,rng: s.new_vacancy(n, layers=rng.choice(LAYERS)),
-	'remainder':   lambda s,n,rng: None,
+# The layers of the vacancy to create for each parameter (None for no vacancy).
+RANDOM_LAYERS_FUNC = {
+	'divacancy':   lambda rng: BOTH_LAYERS,
+	'monovacancy': lambda rng: rng.choice(LAYERS),
+	'remainder':   lambda rng: None,
 }
-RANDOM_PARAMS = list(set(RANDOM_ASSIGN_FUNC) - set(['remainder']))
+RANDOM_PARAMS = list(set(RANDOM_LAYERS_FUNC) - set(['remainder']))
 
 def gen_random_state(dim, mode, params, rng=random, **kw):
 	state = State(dim, **kw)
@@ -350,55 +449,134 @@ def __populate_state__approx(state, params, rng=random):
 	if remainder_prob > 0:
 		kw_pairs.append(('remainder', remainder_prob))
 
-	nodes = list(state.nodes())
+	nodes = state.grid.all_nodes()
 	chosen = weighted_choice(kw_pairs, howmany=len(nodes), rng=rng)
+	vacancies = []
 	for (node,param) in zip_exact(nodes, chosen):
-		RANDOM_ASSIGN_FUNC[param](state, node, rng)
+		layers = RANDOM_LAYERS_FUNC[param](rng)
+		if layers is not None:
+			vacancies.append((node, layers))
+	state.new_vacancies(vacancies)
 
 # interprets each rate as a target frequency and tries to match them
 #  as closely as possible
 def __populate_state__exact(state, params, rng=random):
-	from .util import partial_sums, differences
-
 	nodes = list(state.nodes())
 	rng.shuffle(nodes)
 
 	# From the shuffled list, select intervals of lengths that best approximate
 	# the specified rate distribution.
 	(keys,rates) = zip(*sorted(params.items(), key=lambda kv:kv[1]))
-	cumul = partial_sums(rates, with_zero=True)
-	indices = list(round(r*len(nodes)) for r in cumul) # interval endpoints
+	cumul = np.cumsum((0.,) + rates)
+	indices = np.round(cumul * len(nodes)).astype(int) # interval endpoints
 
-	assert all(x >= 0 for x in differences(indices)), 'tested prior to this func'
+	assert (np.diff(indices) >= 0).all(), 'tested prior to this func'
 	assert indices[-1] <= len(nodes), 'not possible through floating point error alone'
+	indices = indices.tolist()
 
+	vacancies = []
 	for (key,(start,end)) in zip_exact(keys, window2(indices)):
-		f = RANDOM_ASSIGN_FUNC[key]
+		f = RANDOM_LAYERS_FUNC[key]
 		for node in nodes[start:end]:
-			f(state, node, rng)
+			layers = f(rng)
+			if layers is not None:
+				vacancies.append((node, layers))
+	state.new_vacancies(vacancies)
 
 #------------------------------------------------------------------
 
+# The axial displacements obtained by rotating a cubic displacement.
+# (only a handful of displacements are ever used, so there is no need to
+#  rotate them on every query)
+@memoize
+def axial_rotations_60(disp):
+	return tuple((da, db) for (da, db, _) in hex.cubic_rotations_60(*disp))
+
+@memoize
+def axial_rotations_120(disp):
+	return tuple((da, db) for (da, db, _) in hex.cubic_rotations_120(*disp))
+
+# Axial displacements from a node to its neighbors and trefoil neighbors.
+NEIGHBOR_OFFSETS = axial_rotations_60((-1, 0, 1))
+TREFOIL_OFFSETS = axial_rotations_60((2, -2, 0))
+
+# Grids smaller than this are never searched by dilation. (see nodes_in_distance_range)
+DILATE_MIN_NODES = 160 * 160
+# Largest distance for which the nodes around each node are remembered.
+MAX_SHELL_RADIUS = 3
+
+@memoize
+def axial_shells(maxdist):
+	''' Axial displacements at each distance from 0 to maxdist, ignoring PBC. '''
+	shells = [((0, 0),)]
+	seen = {(0, 0)}
+	for _ in range(maxdist):
+		shell = []
+		for (a, b) in shells[-1]:
+			for (da, db) in NEIGHBOR_OFFSETS:
+				disp = (a + da, b + db)
+				if disp not in seen:
+					seen.add(disp)
+					shell.append(disp)
+		shells.append(tuple(shell))
+	return tuple(shells)
+
 # Periodic hexagonal grid, stored in axial coords.
 class Grid:
+	__slots__ = (
+		'dim', '__all_nodes', '__neighbor_ids', '__shells', '__mutuals',
+		'__trefoil_nbrs', '__trefoil_disps', '__bfs_seen',
+	)
+
 	def __init__(self, dim):
 		self.dim = dim
 		assert len(self.dim) == 2
+		self.__all_nodes = None # tuple, built on demand
+		self.__neighbor_ids = None # list of tuples, built on demand
+		self.__shells = {} # {id: tuple of tuples of ids, by distance}, filled on demand
+		                   # (only up to the largest distance yet asked of that id)
+		self.__mutuals = {} # {node: tuple of (nbr,near,far)}, filled on demand
+		self.__trefoil_nbrs = {} # {node: frozenset}, filled on demand
+		self.__trefoil_disps = frozenset(map(self.reduce, TREFOIL_OFFSETS))
+		self.__bfs_seen = None # zeroed bitmap for bfs, allocated on demand
 
 	def nodes(self):
 		''' Iterate over all nodes. '''
-		return itertools.product(*(range(d) for d in self.dim))
+		return iter(self.all_nodes())
+
+	def all_nodes(self):
+		''' A tuple of all nodes, in the order of their ids. '''
+		# (built once, rather than allocating fresh tuples on every pass)
+		if self.__all_nodes is None:
+			self.__all_nodes = tuple(itertools.product(*(range(d) for d in self.dim)))
+		return self.__all_nodes
+
+	def nodes_array(self):
+		''' All nodes as two flat arrays of their ``a`` and ``b`` coords, in the
+		order of their ids.  (for bulk consumers that work in numpy) '''
+		(a, b) = np.indices(self.dim)
+		return (a.ravel(), b.ravel())
 
 	def neighbors(self, node):
 		''' The six neighbors of a node on a hexagonal lattice. '''
-		return self.rotations_around(node, [-1, 0, 1])
+		(a, b) = node
+		(d0, d1) = self.dim
+		return [((a + da) % d0, (b + db) % d1) for (da, db) in NEIGHBOR_OFFSETS]
 
 	def trefoil_neighbors(self, node):
 		''' The six nodes with which a node can form a trefoil defect.
 
 		For one to actually form, three nodes must all mutually be
-		trefoil neighbors. '''
-		return self.rotations_around(node, [2, -2, 0])
+		trefoil neighbors.
+
+		The output is a frozenset, for fast membership tests. '''
+		try: return self.__trefoil_nbrs[node]
+		except KeyError: pass
+		(a, b) = node
+		(d0, d1) = self.dim
+		out = frozenset(((a + da) % d0, (b + db) % d1) for (da, db) in TREFOIL_OFFSETS)
+		self.__trefoil_nbrs[node] = out
+		return out
 
 	def nodes_in_distance_range(self, nodes, mindist, maxdist):
 		'''
@@ -411,34 +589,147 @@ class Grid:
 		Designed for functions which need to invalidate a region of the grid
 		after making several modifications.
 		'''
-		# structured to avoid unnecessarily computing an extra group
 		if maxdist < mindist: return
-		for (n,group) in enumerate(bfs_groups_by_distance(nodes, self.neighbors)):
-			if n < mindist: continue
-			yield from group
+		nodes = tuple(nodes)
+
+		# A breadth-first search costs python bytecode per node reached, while
+		# dilating a mask over the whole grid costs numpy ops per distance.
+		# Pick the latter once the region may plausibly cover a large grid.
+		# (on small grids, the per-op overhead of numpy dominates)
+		# For the small radii used by the rules, unions of per-node shells are
+		# cheaper still.
+		size = self.dim[0] * self.dim[1]
+		ball_size = 1 + 3 * maxdist * (maxdist + 1)
+		if size >= DILATE_MIN_NODES and len(nodes) * ball_size >= size:
+			yield from self.__nodes_in_distance_range__dilate(nodes, mindist, maxdist)
+		elif maxdist <= MAX_SHELL_RADIUS:
+			yield from self.__nodes_in_distance_range__shells(nodes, mindist, maxdist)
+		else:
+			yield from self.__nodes_in_distance_range__bfs(nodes, mindist, maxdist)
+
+	def __nodes_in_distance_range__shells(self, nodes, mindist, maxdist):
+		shells = self.__shells
+		roots = set(map(self.encode, nodes))
+		# (all_nodes decodes faster, but costs a lot to build on a large grid;
+		#  only use it if something else already built it)
+		table = self.__all_nodes
+		if table is not None:
+			decode = lambda ids: map(table.__getitem__, ids)
+		else:
+			decode = lambda ids: map(divmod, ids, itertools.repeat(self.dim[1]))
+		for root in roots:
+			if len(shells.get(root, ())) <= maxdist:
+				shells[root] = self.__compute_shells(root, maxdist)
+
+		# A node is at distance n from the roots if it is at distance n from
+		# one of them, and no closer to any of them.
+		seen = set()
+		for n in range(maxdist + 1):
+			group = set()
+			for root in roots:
+				group.update(shells[root][n])
+			group -= seen
+			seen |= group
+			if n >= mindist:
+				yield from decode(group)
+
+	def __compute_shells(self, root, maxdist):
+		# The shells around a node are just the shells around the origin,
+		# shifted.  (this is far cheaper than a search on a cold grid, which
+		# must first build the neighbor id table)
+		#
+		# On a grid less than twice as wide as maxdist, a node may be reached
+		# by more than one displacement, and thus appear in several shells;
+		# its distance is the smallest of these.  __nodes_in_distance_range__shells
+		# discards nodes that were already found at smaller distances anyway.
+		(d0, d1) = self.dim
+		(a, b) = divmod(root, d1)
+		return tuple(
+			tuple((a + da) % d0 * d1 + (b + db) % d1 for (da, db) in shell)
+			for shell in axial_shells(maxdist))
+
+	def __nodes_in_distance_range__bfs(self, nodes, mindist, maxdist):
+		decode = self.all_nodes().__getitem__
+		groups = self.__bfs_groups(map(self.encode, nodes), maxdist)
+		for (n,group) in enumerate(groups):
+			if n >= mindist:
+				yield from map(decode, group)
+
+	def __bfs_groups(self, ids, maxdist):
+		''' Lists of the ids at distance 0 to maxdist from some ids. '''
+		# The search marks node ids in a bitmap over the whole grid.
+		# The bitmap is reused across calls (so that small regions don't pay to
+		# allocate it), which means the marks must be cleared afterwards.
+		seen = self.__bfs_seen
+		self.__bfs_seen = None # in case of a nested call
+		if seen is None:
+			seen = bytearray(self.dim[0] * self.dim[1])
+
+		visited = []
+		edge_func = self.__neighbor_id_table().__getitem__
+		try:
+			for (n,group) in enumerate(bfs_groups_by_distance(ids, edge_func, seen)):
+				visited += group
+				yield group
+				if n >= maxdist: break
+		except GeneratorExit:
+			raise # (closed at the yield; every mark is in visited)
+		except BaseException:
+			# The search may have died partway through marking a group, leaving
+			# marks that aren't in visited.  Let the next call make a new bitmap.
+			seen = None
+			raise
+		finally:
+			if seen is not None:
+				for x in visited:
+					seen[x] = 0
+				self.__bfs_seen = seen
+
+	def __nodes_in_distance_range__dilate(self, nodes, mindist, maxdist):
+		current = np.zeros(self.dim, dtype=bool)
+		for node in nodes:
+			current[self.reduce(node)] = True
+		seen = current.copy()
+
+		# structured to avoid unnecessarily computing an extra group
+		for n in itertools.count():
+			if n >= mindist:
+				yield from map(tuple, np.argwhere(current).tolist())
 			if n >= maxdist: break
 
+			# np.roll takes care of PBC
+			grown = np.zeros_like(current)
+			for disp in NEIGHBOR_OFFSETS:
+				grown |= np.roll(current, disp, axis=(0, 1))
+			current = grown & ~seen
+			seen |= current
+			if not current.any(): break # the grid is exhausted
+
 	def rotations_around(self, node, disp):
 		''' Get the node at node+disp, together with the other 5 nodes
 		related to it by the sixfold rotational symmetry around node. '''
-		a,b = node
-		for da, db, _ in hex.cubic_rotations_60(*disp):
-			yield self.reduce((a + da, b + db))
+		(a, b) = node
+		(d0, d1) = self.dim
+		return [((a + da) % d0, (b + db) % d1) for (da, db) in axial_rotations_60(tuple(disp))]
 
 	def rotations_around_threefold(self, node, disp):
 		''' Get the node at node+disp, together with the other 2 nodes
 		related to it by the threefold rotational symmetry around node. '''
-		a,b = node
-		for da, db, _ in hex.cubic_rotations_120(*disp):
-			yield self.reduce((a + da, b + db))
+		(a, b) = node
+		(d0, d1) = self.dim
+		return [((a + da) % d0, (b + db) % d1) for (da, db) in axial_rotations_120(tuple(disp))]
 
 	def can_form_trefoil(self, nodes):
 		''' Determine if the three given nodes can form a trefoil defect. '''
-		n1,n2,n3 = nodes
-		return all(
-			u in self.trefoil_neighbors(v)
-			for (u,v) in [(n1,n2), (n2,n3), (n3,n1)]
-		)
+		# Equivalent to testing that the nodes are mutual trefoil_neighbors,
+		# but done on the displacements between them (modulo the cell), so that
+		# it needs no per-node data.
+		(a1,b1),(a2,b2),(a3,b3) = nodes
+		(d0, d1) = self.dim
+		disps = self.__trefoil_disps
+		return (((a1 - a2) % d0, (b1 - b2) % d1) in disps
+			and ((a2 - a3) % d0, (b2 - b3) % d1) in disps
+			and ((a3 - a1) % d0, (b3 - b1) % d1) in disps)
 
 	def neighbors_and_mutuals(self, node):
 		'''
@@ -448,6 +739,14 @@ class Grid:
 		and ``nbr``.  They are such that ``(node, nbr, near)`` are all attached to the
 		same metal ion, and ``(node, nbr, far)`` are all on the same honeycomb cell.
 		'''
+		# These are fixed for the lifetime of the grid and are queried for every
+		# divacancy on every update, so they are worth remembering.
+		try: return self.__mutuals[node]
+		except KeyError: pass
+		out = self.__mutuals[node] = tuple(self.__compute_neighbors_and_mutuals(node))
+		return out
+
+	def __compute_neighbors_and_mutuals(self, node):
 		rotations = self.rotations_around_threefold
 		nbrs  = rotations(node, [-1,  1,  0])
 		nears = rotations(node, [ 0,  1, -1])
@@ -463,18 +762,193 @@ class Grid:
 		a, b = node
 		return (a % self.dim[0], b % self.dim[1])
 
-
-def bfs_groups_by_distance(roots, edge_func):
-	seen = set()
-	current = set(roots)
-	while True:
+	# Node ids are an alternative representation of the nodes in the unit
+	# cell as ints from 0 to the number of nodes, in the order of ``nodes()``.
+	def encode(self, node):
+		''' Get the id of a node. (PBC are applied, like ``reduce``) '''
+		a, b = node
+		return (a % self.dim[0]) * self.dim[1] + (b % self.dim[1])
+
+	def decode(self, id):
+		''' Get the node with a given id. '''
+		return self.all_nodes()[id]
+
+	def neighbor_ids(self, id):
+		''' ``neighbors``, operating on node ids. '''
+		return self.__neighbor_id_table()[id]
+
+	def __neighbor_id_table(self):
+		# The neighbors of every node are needed by any search of the grid, and
+		# are cheap to compute all at once in numpy.
+		if self.__neighbor_ids is None:
+			(d0, d1) = self.dim
+			(a, b) = self.nodes_array()
+			columns = [((a + da) % d0 * d1 + (b + db) % d1).tolist() for (da, db) in NEIGHBOR_OFFSETS]
+			self.__neighbor_ids = list(zip(*columns))
+		return self.__neighbor_ids
+
+
+def bfs_groups_by_distance(roots, edge_func, seen):
+	''' Yield lists of the ids at distance 0, 1, 2... from the roots.
+
+	Ids must be valid indices into ``seen``, a zeroed bytearray in which
+	visited ids are marked. (cheaper than a set; the marks are left behind
+	for the caller to clear, so that it can be reused)
+
+	Stops once a group is empty, as all further groups would be too. '''
+	current = []
+	for x in roots:
+		if not seen[x]:
+			seen[x] = 1
+			current.append(x)
+
+	while current:
 		yield current
-		seen |= current
 		prev = current
 
-		current = set()
+		current = []
 		for x in prev:
-			new = set(edge_func(x))
-			new -= seen
-			current.update(new)
-
+			for y in edge_func(x):
+				if not seen[y]:
+					seen[y] = 1
+					current.append(y)
+
+
+import unittest
+class GridSearchTests(unittest.TestCase):
+
+	# Every implementation of nodes_in_distance_range, by name.
+	METHODS = ('bfs', 'dilate', 'shells')
+
+	def applies(self, method, maxdist):
+		return method != 'shells' or maxdist <= MAX_SHELL_RADIUS
+
+	def search(self, grid, method, roots, mindist, maxdist):
+		func = getattr(grid, '_Grid__nodes_in_distance_range__' + method)
+		out = list(func(roots, mindist, maxdist))
+		self.assertEqual(len(out), len(set(out)), 'duplicate nodes')
+		return set(out)
+
+	def check_methods_agree(self, grid, roots, mindist, maxdist):
+		# compare distance by distance, so that a node reported at the
+		# wrong distance can't hide in a larger range
+		for n in range(mindist, maxdist + 1):
+			expected = self.search(grid, 'bfs', roots, n, n)
+			for method in filter(lambda m: self.applies(m, n), self.METHODS):
+				self.assertSetEqual(self.search(grid, method, roots, n, n), expected,
+					'{} at distance {} from {}'.format(method, n, roots))
+
+		expected = self.search(grid, 'bfs', roots, mindist, maxdist)
+		self.assertSetEqual(set(grid.nodes_in_distance_range(roots, mindist, maxdist)), expected)
+
+	def random_roots(self, rng, grid, count):
+		return [rng.choice(grid.all_nodes()) for _ in range(count)]
+
+	def test_small_grids(self):
+		rng = random.Random(0)
+		for dim in [(1,1), (2,3), (5,5), (6,9)]:
+			grid = Grid(dim)
+			for count in range(4):
+				roots = self.random_roots(rng, grid, count)
+				self.check_methods_agree(grid, roots, 0, 6)
+				self.check_methods_agree(grid, roots, 2, 4)
+
+	def test_large_grid(self):
+		rng = random.Random(1)
+		grid = Grid((160, 160))
+		self.assertGreaterEqual(160 * 160, DILATE_MIN_NODES)
+		for count in [1, 3]:
+			roots = self.random_roots(rng, grid, count)
+			self.check_methods_agree(grid, roots, 0, 4)
+
+		# enough roots that the public method switches to dilation
+		roots = self.random_roots(rng, grid, 2000)
+		self.check_methods_agree(grid, roots, 0, 2)
+
+	def test_shells(self):
+		rng = random.Random(2)
+		# (including grids so small that shells overlap themselves)
+		for dim in [(1,1), (1,2), (2,2), (3,3), (4,4), (5,7), (7,5), (12,12)]:
+			grid = Grid(dim)
+			for count in range(5):
+				roots = self.random_roots(rng, grid, count)
+				roots += roots[:2] # duplicates
+				for (lo, hi) in [(0,0), (0,1), (1,1), (1,3), (2,3), (3,3)]:
+					expected = self.search(grid, 'bfs', roots, lo, hi)
+					# on a grid that has shells up to a smaller distance cached,
+					# and on one with nothing cached
+					self.assertSetEqual(self.search(grid, 'shells', roots, lo, hi), expected)
+					self.assertSetEqual(self.search(Grid(dim), 'shells', roots, lo, hi), expected)
+
+			# again, now that the shells are all cached
+			roots = list(grid.all_nodes())[:3]
+			self.check_methods_agree(grid, roots, 0, MAX_SHELL_RADIUS)
+
+	def test_exhausted_grid(self):
+		grid = Grid((4, 4))
+		self.check_methods_agree(grid, [(0,0)], 0, 10)
+		self.assertEqual(len(list(grid.nodes_in_distance_range([(0,0)], 0, 10))), 16)
+
+	def test_distance_one(self):
+		grid = Grid((10, 10))
+		expected = {(3,3)} | set(grid.neighbors((3,3)))
+		self.assertSetEqual(set(grid.nodes_in_distance_range([(3,3)], 0, 1)), expected)
+		self.assertSetEqual(set(grid.nodes_in_distance_range([(3,3)], 1, 1)), expected - {(3,3)})
+		self.assertSetEqual(set(grid.nodes_in_distance_range([(3,3)], 2, 1)), set())
+
+	def test_roots_outside_cell(self):
+		grid = Grid((10, 10))
+		for method in self.METHODS:
+			self.assertSetEqual(
+				self.search(grid, method, [(0,-1), (13,3)], 0, 2),
+				self.search(grid, method, [(0,9), (3,3)], 0, 2))
+
+	def test_search_after_error(self):
+		# a failed search must not leave anything behind for later searches
+		grid = Grid((10, 10))
+		expected = set(grid.nodes_in_distance_range([(3,3)], 0, 5))
+		with self.assertRaises(TypeError):
+			list(grid.nodes_in_distance_range([(3,3), None], 0, 5))
+		self.assertSetEqual(set(grid.nodes_in_distance_range([(3,3)], 0, 5)), expected)
+
+class StateCopyTests(unittest.TestCase):
+
+	def make_state(self, zobrist):
+		state = State((6, 6), zobrist=zobrist)
+		state.new_vacancy((1,1), 1)
+		state.new_vacancy((2,4), BOTH_LAYERS)
+		state.new_trefoil(((4,0), (4,2), (2,2)))
+		state.validate()
+		return state
+
+	def check_independent_copy(self, state, copy):
+		copy.validate()
+		self.assertEqual(sorted(copy.to_dict()['vacancies']), sorted(state.to_dict()['vacancies']))
+		self.assertEqual(sorted(copy.to_dict()['trefoils']), sorted(state.to_dict()['trefoils']))
+		if state.is_zobrist_enabled():
+			self.assertEqual(copy.zobrist_key(), state.zobrist_key())
+
+		# modifying either one must leave the other intact
+		copy.pop_vacancy((1,1))
+		copy.validate()
+		state.validate()
+		self.assertTrue(state.is_monovacancy((1,1)))
+
+		state.pop_trefoil(((4,0), (4,2), (2,2)))
+		state.validate()
+		copy.validate()
+		self.assertTrue(copy.is_trefoil((4,0)))
+
+	def test_round_trips(self):
+		import copy, pickle
+		methods = {
+			'clone': State.clone,
+			'copy': copy.copy,
+			'deepcopy': copy.deepcopy,
+			'pickle': lambda s: pickle.loads(pickle.dumps(s)),
+		}
+		for zobrist in [None, 32, HASH]:
+			for (name, func) in methods.items():
+				with self.subTest(method=name, zobrist=zobrist):
+					state = self.make_state(zobrist)
+					self.check_independent_copy(state, func(state))
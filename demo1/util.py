@@ -1,6 +1,7 @@
 import logging
 import operator
 import functools
+import itertools
 from termcolor import colored
 
 # FIXME color in here is a total hack
@@ -12,12 +13,17 @@ class debug():
 
 	def __call__(self, func):
 		from functools import wraps
+		log = logging.getLogger()
+		prefix = colored(self.prefix, 'green')
+		name = colored(func.__name__, 'yellow')
+		skip = 1 if self.is_member else 0
+
 		@wraps(func)
 		def wrapped(*args, **kw):
-			args2show = args[1 if self.is_member else 0:]
-			logging.debug(
-				colored(self.prefix, 'green') +
-				format_func_call(colored(func.__name__, 'yellow'), args2show, kw))
+			# (formatting the args is expensive; don't do it for nothing)
+			if log.isEnabledFor(logging.DEBUG):
+				# (logging.debug, unlike log.debug, sets up a handler if there is none)
+				logging.debug(prefix + format_func_call(name, args[skip:], kw))
 			return func(*args, **kw)
 		return wrapped
 
@@ -75,15 +81,28 @@ def zip_exact(*args):
 	'''
 	zip iterables of equal length (or error).
 
-	Warning: current implementation is not lazy and will fully traverse
-	each iterable before returning. (soz)
+	This is lazy; a length mismatch is only detected (raising ValueError)
+	once the shortest iterable runs out.
 	'''
 	if len(args) == 0:
-		return ()
-	first,*rest = map(list, args)
-	if any(len(x) != len(first) for x in rest):
+		return
+	# The zip should end by exhausting the first iterable, after which the
+	# rest must be empty.  (a marker is chained onto the first one to tell
+	# whether it was the one to run out)
+	first_done = []
+	def mark_first_done():
+		first_done.append(True)
+		yield from ()
+
+	first = itertools.chain(args[0], mark_first_done())
+	rest = [iter(x) for x in args[1:]]
+	yield from zip(first, *rest)
+
+	if not first_done:
 		raise ValueError('mismatched lengths')
-	return zip(first, *rest)
+	for it in rest:
+		for _ in it:
+			raise ValueError('mismatched lengths')
 
 def intersperse(x, iterable):
 	'''
@@ -102,6 +121,16 @@ def memoize(func):
 
 	This caches the output of every call to the function, and returns the
 	recorded result whenever the same set of arguments are seen again.
+
+	The cache lookup is done in C by ``functools.lru_cache``, but the result
+	can't be pickled unless it replaces a module-level function of the same
+	name.  See ``memoize_picklable``.
+	'''
+	return functools.lru_cache(maxsize=None)(func)
+
+def memoize_picklable(func):
+	'''
+	``memoize``, but picklable without dill (if ``func`` is). Slower.
 	'''
 	# NOTE: written this way to be picklable without dill.
 	wrapped = functools.partial(__memoize__inner, {}, func)
@@ -23,15 +23,18 @@ def validate_no_dupes(it, name='sequence', item='item'):
 		raise AssertionError('duplicate {!s} in {!s}: {!r}'.format(item, name, dupe))
 
 def validate_dict(d1, d2, name1='left', name2='right', key='key', value='value'):
-	validate_set(set(d1), set(d2), name1, name2, item=key)
+	# (keys views support set operations, so there's no need to copy them)
+	validate_set(d1.keys(), d2.keys(), name1, name2, item=key)
 
-	for k in d1:
-		if d1[k] != d2[k]:
+	for (k, v1) in d1.items():
+		v2 = d2[k]
+		if v1 != v2:
 			# (note: the blank tabulate entries are to make a small indent)
 			head = '{!s} mismatch for {!s}: {!r}'.format(value, key, k)
-			table = tabulate([['', name1, repr(d1[k])], ['', name2, repr(d2[k])]], tablefmt='plain')
+			table = tabulate([['', name1, repr(v1)], ['', name2, repr(v2)]], tablefmt='plain')
 			raise AssertionError('%s\n%s' % (head,table))
 
+# (accepts sets, or anything else that supports ``-`` like one; e.g. dict keys)
 def validate_set(set1, set2, name1='left', name2='right', item='item'):
 	diff = set1 - set2
 	if diff:
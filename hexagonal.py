@@ -42,6 +42,11 @@ def cubic_to_axial(a,b,c): return (a, b)
 def cubic_to_axialsum(a,b,c): return (a, b, a+b+c)
 def axialsum_to_cubic(a,b,p): return (a, b, p-a-b)
 
+_HALF_SQRT3 = 0.8660254037844386
+
+# (the conversions to cartesian only use arithmetic operators, so they also
+#  work elementwise on numpy arrays of a, b, and c; converting a whole lattice
+#  at once is far cheaper than calling them once per point)
 def cubic_to_cart(a,b,c):
 	'''
 	Map the points to cartesian.
@@ -49,25 +54,37 @@ def cubic_to_cart(a,b,c):
 	Treats the 'a' vector as pointing SE, the 'b' vector as pointing NE,
 	and the 'c' vector as pointing W.
 	'''
-	return (0.5*(a+b)-c, 0.5*(3**0.5)*(b-a))
+	return (0.5*(a+b)-c, _HALF_SQRT3*(b-a))
 def axialsum_to_cart(a,b,p):
-	return cubic_to_cart(*axialsum_to_cubic(a,b,p))
+	# (cubic_to_cart with c = p-a-b substituted)
+	return (1.5*(a+b)-p, _HALF_SQRT3*(b-a))
+
+# The rotations_* functions return a tuple of every image of a point,
+#  starting from the point itself.  Each one is written out by hand;
+#  the definition is ``tuple(_unfold(rotate, point, count))``, which is
+#  much slower (mostly from running the generator).
+#
+# Like the conversions to cartesian, they also work on numpy arrays of
+#  coordinates; ``np.array(cubic_rotations_60(A, B, C))`` gives all images
+#  of N points as an array of shape (6, 3, N).
 
 def cubic_rotate_60(a,b,c): return (-b, -c, -a)
 def cubic_rotations_60(a,b,c):
-	return _unfold(cubic_rotate_60, (a,b,c), 6)
+	return ((a,b,c), (-b,-c,-a), (c,a,b), (-a,-b,-c), (b,c,a), (-c,-a,-b))
 
 def cubic_rotate_120(a,b,c): return (c, a, b)
 def cubic_rotations_120(a,b,c):
-	return _unfold(cubic_rotate_120, (a,b,c), 3)
+	return ((a,b,c), (c,a,b), (b,c,a))
 
 def axialsum_rotate_60(a,b,p): return (-b, a+b-p, -p)
 def axialsum_rotations_60(a,b,p):
-	return _unfold(axialsum_rotate_60, (a,b,p), 6)
+	c = p-a-b
+	return ((a,b,p), (-b,-c,-p), (c,a,p), (-a,-b,-p), (b,c,p), (-c,-a,-p))
 
 def axialsum_rotate_120(a,b,p): return (p-a-b, a, p)
 def axialsum_rotations_120(a,b,p):
-	return _unfold(axialsum_rotate_120, (a,b,p), 3)
+	c = p-a-b
+	return ((a,b,p), (c,a,p), (b,c,p))
 
 def _unfold(f, start, takeN):
 	for _ in range(takeN):
@@ -1,2 +1,2 @@
 #!/bin/bash
-nosetests3 demo1/incremental.py || exit 1
+nosetests3 demo1/incremental.py demo1/state.py || exit 1